@@ -1,95 +1,321 @@
+import itertools
+import json
 import os
-from typing import List, Dict
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
 from .ingest import chunk_text
 from .embeddings import EmbeddingModel
 from .vector_store import InMemoryVectorStore
 
 # Directories and files to ignore during codebase indexing
-IGNORE_DIRS = {
+IGNORE_DIRS = frozenset({
     "node_modules", ".next", "__pycache__", ".git", "venv", "env", 
-    "dist", "build", ".vscode", ".idea", "chroma_db", "data"
-}
-IGNORE_EXTENSIONS = {
+    "dist", "build", ".vscode", ".idea", "chroma_db", "codebase_db", "data"
+})
+IGNORE_EXTENSIONS = frozenset({
     ".png", ".jpg", ".jpeg", ".gif", ".svg", ".ico", ".pdf", ".zip", 
     ".tar", ".gz", ".exe", ".dll", ".so", ".pyc", ".pyo", ".db", ".sqlite",
     ".bin", ".onnx", ".pkl", ".pt"
-}
+})
 # Explicitly supported database and config extensions
-SUPPORTED_DATA_EXTENSIONS = {
+SUPPORTED_DATA_EXTENSIONS = frozenset({
     ".sql", ".prisma", ".dbml", ".yaml", ".yml", ".json", ".xml"
-}
+})
+# Source extensions (and extension-less names) indexed when CODEBASE_ALLOWLIST_ONLY=1.
+# No ".env": env files hold secrets and chunks are sent to the LLM as context.
+SUPPORTED_SOURCE_EXTENSIONS = frozenset({
+    ".py", ".ts", ".tsx", ".js", ".jsx", ".html", ".css", ".md", ".txt",
+    ".sh", ".toml", ".ini", ".cfg", ".go", ".rs", ".java", ".c", ".h",
+    ".cpp", ".hpp", ".rb", ".php"
+})
+SUPPORTED_FILENAMES = frozenset({"Dockerfile", "Makefile", "README", "LICENSE"})
+# Bytes sniffed for a NUL before reading the rest of a file (binary detection)
+BINARY_SNIFF_BYTES = 128
 
 class CodebaseAssistant:
-    def __init__(self, root_dir: str, embedder: EmbeddingModel):
+    def __init__(self, root_dir: str, embedder: EmbeddingModel, dtype=np.float16):
         self.root_dir = root_dir
         self.embedder = embedder
         # Initialize a separate vector store for the codebase
         # We use a distinct persist_directory to avoid mixing with uploaded documents
         self.persist_dir = os.path.join(os.path.dirname(__file__), '..', 'codebase_db')
         os.makedirs(self.persist_dir, exist_ok=True)
-        self.vector_store = InMemoryVectorStore(dim=embedder.dim, persist_directory=self.persist_dir)
+        self.vector_store = InMemoryVectorStore(dim=embedder.dim, persist_directory=self.persist_dir, dtype=dtype)
         self.is_indexed = False
+        # rel_path -> [mtime_ns, size, chunk_ids] for the files the vector store holds.
+        # Only trusted across restarts when the store itself persists.
+        self.cache_path = os.path.join(self.persist_dir, 'index_manifest.json')
+        self.manifest: Dict[str, list] = self._load_manifest() if self.vector_store.is_persistent else {}
+        # Only index known source/data files instead of everything not ignored
+        self.allowlist_only = os.environ.get("CODEBASE_ALLOWLIST_ONLY", "0").strip().lower() in {"1", "true", "yes", "on"}
+        self.allowed_extensions = SUPPORTED_SOURCE_EXTENSIONS | SUPPORTED_DATA_EXTENSIONS
+        # One indexing run at a time: a search arriving during startup indexing waits
+        # for it instead of starting a second, concurrent run
+        self._index_lock = threading.Lock()
+        # Set by stop_indexing() on shutdown; a running index stops after its current batch
+        self._stop_indexing = threading.Event()
+
+    def stop_indexing(self):
+        """Ask a running index_codebase() to stop, and refuse to start new runs."""
+        self._stop_indexing.set()
 
     def index_codebase(self, force: bool = False):
-        if self.is_indexed and not force:
-            return
+        with self._index_lock:
+            if (self.is_indexed and not force) or self._stop_indexing.is_set():
+                return
+            self._index_codebase()
 
+    def _index_codebase(self):
         print(f"Indexing codebase at {self.root_dir}...")
-        all_chunks = []
-        all_ids = []
-        all_metadatas = []
-
-        for root, dirs, files in os.walk(self.root_dir):
-            # Filter out ignored directories
-            dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
+        # Add chunks in batches to avoid OOM or API limits.
+        # A producer thread walks/reads the tree while this thread embeds ready batches;
+        # the bounded queue plus a cap on reads in flight keep memory at a few batches
+        # instead of the whole repo.
+        batch_size = 100
+        batches: "queue.Queue" = queue.Queue(maxsize=4)
+        stop = threading.Event()
+        producer_error: List[BaseException] = []
 
-            for file in files:
-                ext = os.path.splitext(file)[1].lower()
-                if ext in IGNORE_EXTENSIONS:
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
                     continue
+            return False
 
-                file_path = os.path.join(root, file)
-                rel_path = os.path.relpath(file_path, self.root_dir)
+        previous = self.manifest
+        manifest: Dict[str, list] = {}
+        reused = [0]
 
-                try:
-                    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                        content = f.read()
-                        if not content.strip():
-                            continue
-                        
-                        # Add a header to the content so the LLM knows which file it's looking at
-                        header = f"File: {rel_path}\n\n"
-                        chunks = chunk_text(header + content, max_chars=2000, overlap_chars=200)
-                        
-                        for i, chunk in enumerate(chunks):
-                            chunk_id = f"{rel_path}:{i}"
-                            all_chunks.append(chunk)
-                            all_ids.append(chunk_id)
-                            all_metadatas.append({
-                                "path": rel_path,
-                                "chunk_index": i,
-                                "type": "codebase"
-                            })
-                except Exception as e:
-                    print(f"Error reading {file_path}: {e}")
-
-        if all_chunks:
-            # Add chunks in batches to avoid OOM or API limits
-            batch_size = 100
-            for i in range(0, len(all_chunks), batch_size):
-                batch_chunks = all_chunks[i:i + batch_size]
-                batch_ids = all_ids[i:i + batch_size]
-                batch_metadatas = all_metadatas[i:i + batch_size]
-                
-                embeddings = self.embedder.embed_texts(batch_chunks)
-                self.vector_store.add_many(batch_ids, embeddings, batch_chunks, metadatas=batch_metadatas)
+        def produce():
+            pending_chunks: List[str] = []
+            pending_ids: List[str] = []
+            pending_metadatas: List[Dict] = []
+            # ids of changed/removed files, deleted before the batch that carries them is added
+            stale_ids: List[str] = []
+            try:
+                # File reads are I/O-bound and independent, so overlap them on threads.
+                # At most 2x max_workers reads are in flight; more are submitted only as
+                # results are consumed, so a blocked queue also stops the walk.
+                max_workers = min(32, (os.cpu_count() or 1) * 4)
+                max_in_flight = 2 * max_workers
+                files = self._iter_files()
+                in_flight: Dict = {}
+                # Pool threads are not daemons: drop queued reads before its shutdown joins them
+                with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="codebase-read") as pool:
+                    try:
+                        while not (stop.is_set() or self._stop_indexing.is_set()):
+                            for rel_path, file_path in itertools.islice(files, max_in_flight - len(in_flight)):
+                                future = pool.submit(self._index_file, rel_path, file_path, previous.get(rel_path))
+                                in_flight[future] = rel_path
+                            if not in_flight:
+                                break
+                            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                rel_path = in_flight.pop(future)
+                                entry, chunks, ids, metadatas = future.result()
+                                if entry is None:
+                                    continue
+                                manifest[rel_path] = entry
+                                if chunks is None:
+                                    # unchanged since the last index; keep its existing vectors
+                                    reused[0] += len(entry[2])
+                                    continue
+                                if rel_path in previous:
+                                    stale_ids.extend(previous[rel_path][2])
+                                pending_chunks.extend(chunks)
+                                pending_ids.extend(ids)
+                                pending_metadatas.extend(metadatas)
+                                while len(pending_chunks) >= batch_size:
+                                    if not put((stale_ids, pending_chunks[:batch_size], pending_ids[:batch_size], pending_metadatas[:batch_size])):
+                                        return
+                                    stale_ids = []
+                                    del pending_chunks[:batch_size], pending_ids[:batch_size], pending_metadatas[:batch_size]
+                    finally:
+                        for future in in_flight:
+                            future.cancel()
+                if stop.is_set() or self._stop_indexing.is_set():
+                    return
+                for rel_path, entry in previous.items():
+                    if rel_path not in manifest:
+                        stale_ids.extend(entry[2])
+                if pending_chunks or stale_ids:
+                    put((stale_ids, pending_chunks, pending_ids, pending_metadatas))
+            except BaseException as e:
+                producer_error.append(e)
+            finally:
+                put(None)
 
+        producer = threading.Thread(target=produce, name="codebase-walk", daemon=True)
+        producer.start()
+        indexed = 0
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None or self._stop_indexing.is_set():
+                    break
+                stale_ids, batch_chunks, batch_ids, batch_metadatas = batch
+                if stale_ids:
+                    self.vector_store.delete_ids(stale_ids)
+                if batch_chunks:
+                    embeddings = self.embedder.embed_texts(batch_chunks)
+                    self.vector_store.add_many(batch_ids, embeddings, batch_chunks, metadatas=batch_metadatas)
+                    indexed += len(batch_chunks)
+        finally:
+            stop.set()
+            producer.join()
+        if producer_error:
+            raise producer_error[0]
+        if self._stop_indexing.is_set():
+            # Partial run: keep the previous manifest, whose entries still describe
+            # every file this run didn't finish (changed files differ in signature)
+            print(f"Codebase indexing stopped after {indexed} chunks.")
+            return
+
+        self.manifest = manifest
+        if self.vector_store.is_persistent:
+            # the manifest must never claim vectors that aren't on disk yet
+            self.vector_store.flush()
+            self._save_manifest()
         self.is_indexed = True
-        print(f"Codebase indexing complete. Indexed {len(all_chunks)} chunks.")
+        print(f"Codebase indexing complete. Indexed {indexed} chunks ({reused[0]} unchanged chunks reused).")
+
+    def _load_manifest(self) -> Dict[str, list]:
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"Ignoring unreadable index manifest {self.cache_path}: {e}")
+            return {}
+
+    def _save_manifest(self):
+        # Write to a temp file and swap it in so a crash never leaves a torn manifest
+        tmp_path = f"{self.cache_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.manifest, f)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            print(f"Error writing index manifest {self.cache_path}: {e}")
+
+    def _iter_files(self) -> Iterator[Tuple[str, str]]:
+        """
+        Recursively yield (rel_path, file_path) for indexable files using os.scandir,
+        which reuses the directory entry's type info instead of stat-ing each entry.
+        """
+        stack = [self.root_dir]
+        while stack:
+            current = stack.pop()
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in IGNORE_DIRS:
+                                stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            ext = os.path.splitext(entry.name)[1].lower()
+                            if ext in IGNORE_EXTENSIONS:
+                                continue
+                            if self.allowlist_only and ext not in self.allowed_extensions \
+                                    and entry.name not in SUPPORTED_FILENAMES:
+                                continue
+                            yield os.path.relpath(entry.path, self.root_dir), entry.path
+            except OSError as e:
+                print(f"Error scanning {current}: {e}")
+
+    @staticmethod
+    def _read_file(file_path: str) -> Optional[str]:
+        """
+        Read a file as UTF-8 into one preallocated buffer with a single decode.
+        Returns None for binary files (a NUL byte in the first few bytes).
+        """
+        # Not mmap: the tree is live, and a page of a file truncated mid-decode
+        # raises SIGBUS, which kills the process instead of raising an exception.
+        with open(file_path, "rb", buffering=0) as f:
+            head = f.read(BINARY_SNIFF_BYTES)
+            if b"\x00" in head:
+                return None
+            size = max(os.fstat(f.fileno()).st_size, len(head))
+            buf = bytearray(size)
+            view = memoryview(buf)
+            view[:len(head)] = head
+            n = len(head)
+            # stops early if the file shrank since fstat
+            while n < size:
+                read = f.readinto(view[n:])
+                if not read:
+                    break
+                n += read
+            return str(view[:n], "utf-8", "ignore")
+
+    def _index_file(self, rel_path: str, file_path: str, previous: Optional[list]):
+        """
+        Returns (manifest_entry, chunks, ids, metadatas). The entry is None if the
+        file can't be stat-ed or read (so it is retried next run instead of being
+        recorded with no chunks); chunks is None if (mtime, size) match `previous`.
+        """
+        try:
+            st = os.stat(file_path)
+        except OSError as e:
+            print(f"Error reading {file_path}: {e}")
+            return None, None, None, None
+        signature = [st.st_mtime_ns, st.st_size]
+        if previous is not None and previous[:2] == signature:
+            return previous, None, None, None
+        result = self._read_and_chunk(rel_path, file_path)
+        if result is None:
+            return None, None, None, None
+        chunks, ids, metadatas = result
+        return signature + [ids], chunks, ids, metadatas
+
+    def _read_and_chunk(self, rel_path: str, file_path: str) -> Optional[Tuple[List[str], List[str], List[Dict]]]:
+        """
+        Returns (chunks, ids, metadatas), empty for binary or blank files, or None
+        if the file couldn't be read.
+        """
+        chunks: List[str] = []
+        ids: List[str] = []
+        metadatas: List[Dict] = []
+        try:
+            content = self._read_file(file_path)
+            if content is None or not content.strip():
+                return chunks, ids, metadatas
+
+            # Add a header to the content so the LLM knows which file it's looking at
+            header = f"File: {rel_path}\n\n"
+            chunks = chunk_text(content, max_chars=2000, overlap_chars=200, header=header)
+
+            for i in range(len(chunks)):
+                ids.append(f"{rel_path}:{i}")
+                metadatas.append({
+                    "path": rel_path,
+                    "chunk_index": i,
+                    "type": "codebase"
+                })
+        except Exception as e:
+            print(f"Error reading {file_path}: {e}")
+            return None
+        return chunks, ids, metadatas
 
     def search(self, query: str, top_k: int = 10) -> List[Dict]:
+        return self.vector_store.search(self._embed_query(query), top_k=top_k)
+
+    def search_texts(self, query: str, top_k: int = 10) -> List[str]:
+        """
+        Like search(), but returns only the chunk texts (no per-hit dicts).
+        """
+        return self.vector_store.search_texts(self._embed_query(query), top_k=top_k)
+
+    def _embed_query(self, query: str):
         if not self.is_indexed:
             self.index_codebase()
         
-        q_emb = self.embedder.embed_texts([query])[0]
-        return self.vector_store.search(q_emb, top_k=top_k)
+        return self.embedder.embed_query(query)
@@ -17,6 +17,9 @@ class Settings(BaseSettings):
     OLLAMA_URL: str = "http://localhost:11434"
     OLLAMA_MODEL: str = "qwen2.5:14b"
     OLLAMA_TIMEOUT_S: float = 600.0
+    # Same context size on every call so Ollama never reloads the model between requests
+    OLLAMA_NUM_CTX: int = 8192
+    OLLAMA_KEEP_ALIVE: str = "30m"
     TGI_URL: str = ""
     
     # RAG Config
@@ -25,6 +28,8 @@ class Settings(BaseSettings):
     CHUNK_MAX_CHARS: int = 2000
     CHUNK_OVERLAP_CHARS: int = 200
     MAX_CHUNKS_PER_DOC: int = 500
+    # Storage precision of in-memory vectors: float32 | float16 | int8
+    VECTOR_STORE_DTYPE: str = "float16"
     
     # Security & Limits
     ALLOWED_ORIGINS: List[str] = [
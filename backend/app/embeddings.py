@@ -1,6 +1,79 @@
 from sentence_transformers import SentenceTransformer
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import functools
+import inspect
+import logging
+import multiprocessing
 import numpy as np
 import os
+import threading
+
+try:
+    from scipy.linalg.blas import snrm2, sscal
+    BLAS_AVAILABLE = True
+except Exception:
+    BLAS_AVAILABLE = False
+
+# Per-process model used by the CPU embedding pool (see MULTIPROC_EMBED)
+_WORKER_MODEL = None
+_WORKER_FUSED = False
+
+
+def _supports_normalize(model) -> bool:
+    """True if model.encode() accepts normalize_embeddings (sentence-transformers >= 2.x)."""
+    try:
+        return "normalize_embeddings" in inspect.signature(model.encode).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def _encode_normalized(model, texts, batch_size: int, fused: bool) -> np.ndarray:
+    if fused:
+        # Normalization is fused into encode(); no extra passes over the matrix here.
+        return model.encode(
+            texts,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            batch_size=batch_size,
+            normalize_embeddings=True,
+        )
+    # Older sentence-transformers without normalize_embeddings
+    emb = model.encode(
+        texts,
+        show_progress_bar=False,
+        convert_to_numpy=True,
+        batch_size=batch_size,
+    )
+    return _normalize_inplace(emb)
+
+
+def _normalize_inplace(emb: np.ndarray) -> np.ndarray:
+    """L2-normalize rows in place (multiply by the inverse norm, no new array)."""
+    # BLAS snrm2/sscal only apply to fp32 rows; anything else uses the NumPy path
+    if BLAS_AVAILABLE and emb.dtype == np.float32 and emb.flags.c_contiguous:
+        for row in emb:
+            inv = 1.0 / (snrm2(row) + 1e-12)
+            sscal(inv, row)  # rank-1 fp32 row is scaled in place
+        return emb
+    inv = np.linalg.norm(emb, axis=1, keepdims=True)
+    inv += 1e-12
+    np.reciprocal(inv, out=inv)
+    emb *= inv
+    return emb
+
+
+def _init_worker(model_name: str, num_threads: int):
+    global _WORKER_MODEL, _WORKER_FUSED
+    import torch
+    # Split the cores between workers instead of every worker grabbing all of them
+    torch.set_num_threads(num_threads)
+    _WORKER_MODEL = SentenceTransformer(model_name)
+    _WORKER_FUSED = _supports_normalize(_WORKER_MODEL)
+
+
+def _encode_in_worker(texts, batch_size: int) -> np.ndarray:
+    return _encode_normalized(_WORKER_MODEL, texts, batch_size, _WORKER_FUSED)
 
 
 class EmbeddingModel:
@@ -13,21 +86,99 @@ class EmbeddingModel:
             model_name = os.environ.get("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
         # Guard against accidental quoting from docker-compose like "all-MiniLM-L6-v2"
         model_name = model_name.strip().strip('"').strip("'")
+        self.model_name = model_name
         self.model = SentenceTransformer(model_name)
         # typical embedding dim for mpnet is 768
         self.dim = self.model.get_sentence_embedding_dimension()
+        # Checked once here rather than by catching TypeError around every encode()
+        self._fused_normalize = _supports_normalize(self.model)
+        # Repeated queries skip the transformer forward pass (bytes are hashable/immutable)
+        self._embed_query_cached = functools.lru_cache(maxsize=128)(self._embed_query_bytes)
+        # Optional CPU-only process pool, one model replica per worker (MULTIPROC_EMBED=1)
+        self._pool = None
+        self._pool_workers = 0
+        # embed_texts runs on the indexer thread and request threads at once
+        self._pool_lock = threading.Lock()
+        if os.environ.get("MULTIPROC_EMBED", "0").strip().lower() in {"1", "true", "yes", "on"}:
+            if not self._cuda_available():
+                default_workers = max(1, (os.cpu_count() or 1) // 2)
+                self._pool_workers = int(os.environ.get("MULTIPROC_EMBED_WORKERS", str(default_workers)))
+
+    @staticmethod
+    def _cuda_available() -> bool:
+        try:
+            import torch
+            return torch.cuda.is_available()
+        except Exception:
+            return False
 
-    def embed_texts(self, texts):
+    def _get_pool(self):
+        """Returns (pool, workers), creating the pool on first use; (None, 0) if disabled."""
+        with self._pool_lock:
+            if self._pool is None and self._pool_workers > 1:
+                num_threads = max(1, (os.cpu_count() or 1) // self._pool_workers)
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self._pool_workers,
+                    # spawn: forking a process that already runs torch threads is unsafe
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.model_name, num_threads),
+                )
+            return self._pool, self._pool_workers if self._pool is not None else 0
+
+    def _drop_pool(self, pool):
+        """Discard a broken pool and stop using one; later batches encode in-process."""
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+                self._pool_workers = 0
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def embed_texts(self, texts, dtype=np.float16):
+        """
+        Embed and L2-normalize texts, returning an (N, dim) array of `dtype`.
+        fp16 halves the bytes the vector store scans per query; int8 quantization
+        (per-vector scale) is applied by the vector store at insertion time.
+        """
+        dtype = np.dtype(dtype)
+        if not np.issubdtype(dtype, np.floating):
+            raise ValueError(f"embed_texts only returns float embeddings, got {dtype}")
         batch_size = int(os.environ.get("EMBEDDING_BATCH_SIZE", "16"))
-        emb = self.model.encode(
-            texts,
-            show_progress_bar=False,
-            convert_to_numpy=True,
-            batch_size=batch_size,
-        )
-        # L2-normalize
-        norms = np.linalg.norm(emb, axis=1, keepdims=True) + 1e-12
-        return emb / norms
+        # encode() sorts a list by length before batching (so each batch pads to a
+        # similar length) and restores the original order; make sure it gets one.
+        texts = list(texts)
+        pool, workers = self._get_pool() if len(texts) >= 2 * batch_size else (None, 0)
+        emb = None
+        if pool is not None:
+            # Contiguous shards, one per worker; map() yields them back in order
+            step = -(-len(texts) // workers)
+            shards = [texts[i:i + step] for i in range(0, len(texts), step)]
+            try:
+                emb = np.concatenate(list(pool.map(_encode_in_worker, shards, [batch_size] * len(shards))))
+            except BrokenProcessPool as e:
+                # a worker died (e.g. OOM-killed); don't fail every later large batch
+                logging.warning("Embedding worker pool broke, falling back to in-process encoding: %s", e)
+                self._drop_pool(pool)
+        if emb is None:
+            emb = _encode_normalized(self.model, texts, batch_size, self._fused_normalize)
+        # Cast after normalizing in full precision
+        return emb.astype(dtype, copy=False)
+
+    def embed_text(self, text, dtype=np.float16):
+        return self.embed_texts([text], dtype=dtype)[0]
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """
+        Cached embed_text for search queries. Returns a read-only float16 vector.
+        """
+        return np.frombuffer(self._embed_query_cached(text), dtype=np.float16)
+
+    def _embed_query_bytes(self, text: str) -> bytes:
+        return self.embed_text(text, dtype=np.float16).tobytes()
 
-    def embed_text(self, text):
-        return self.embed_texts([text])[0]
+    def close(self):
+        # no new pool after close(); later embed_texts() calls encode in-process
+        with self._pool_lock:
+            pool, self._pool, self._pool_workers = self._pool, None, 0
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -1,10 +1,24 @@
 import os
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List
+import multiprocessing
 import re
 import tempfile
 import subprocess
 import uuid
 
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except Exception:
+    NUMBA_AVAILABLE = False
+
+# Whitespace normalization used by chunk_text (compiled once, reused per document)
+_WS_RE = re.compile(r"[ \t]+")
+_NL_RE = re.compile(r"\n{3,}")
+
 
 def extract_text(path: str) -> str:
     ext = os.path.splitext(path)[1].lower()
@@ -32,7 +46,12 @@ def extract_text(path: str) -> str:
                 except Exception:
                     raise RuntimeError("PDF is encrypted/password-protected and cannot be processed")
 
-            pages = [p.extract_text() or "" for p in reader.pages]
+            n_pages = len(reader.pages)
+            workers = _pdf_parallel_workers(n_pages)
+            if workers:
+                pages = _extract_pages_parallel(_pypdf_extract_pages, path, n_pages, workers)
+            else:
+                pages = [p.extract_text() or "" for p in reader.pages]
             text = "\n\n".join(pages).strip()
         except Exception as e:
             pypdf_err = e
@@ -43,9 +62,14 @@ def extract_text(path: str) -> str:
             try:
                 import pdfplumber
                 with pdfplumber.open(path) as pdf:
+                    n_pages = len(pdf.pages)
+                    workers = _pdf_parallel_workers(n_pages)
                     parts = []
-                    for page in pdf.pages:
-                        parts.append((page.extract_text() or "").strip())
+                    if not workers:
+                        for page in pdf.pages:
+                            parts.append((page.extract_text() or "").strip())
+                if workers:
+                    parts = _extract_pages_parallel(_plumber_extract_pages, path, n_pages, workers)
                 text2 = "\n\n".join([p for p in parts if p]).strip()
                 if text2:
                     return text2
@@ -77,71 +101,151 @@ def extract_text(path: str) -> str:
         return ""
 
 
-def chunk_text(text: str, max_chars: int = 1600, overlap_chars: int = 250) -> List[str]:
+def _pdf_parallel_workers(n_pages: int) -> int:
+    """
+    Number of worker processes for page extraction, or 0 to stay sequential.
+    Enabled by env PDF_PARALLEL=1; short PDFs aren't worth the worker start-up.
+    """
+    enable = os.environ.get("PDF_PARALLEL", "0").strip().lower() in {"1", "true", "yes", "on"}
+    min_pages = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "16"))
+    if not enable or n_pages < max(2, min_pages):
+        return 0
+    return min(8, os.cpu_count() or 1, n_pages)
+
+
+def _extract_pages_parallel(extract: Callable[[str, int, int], List[str]], path: str, n_pages: int, workers: int) -> List[str]:
+    """
+    Splits the page range into one contiguous slice per worker; each worker opens
+    the PDF itself (page objects share the parser's file handle and aren't picklable).
+    """
+    step = -(-n_pages // workers)
+    starts = list(range(0, n_pages, step))
+    ends = [min(n_pages, start + step) for start in starts]
+    # spawn: the API process may already run torch threads, which fork() doesn't survive
+    with ProcessPoolExecutor(max_workers=len(starts), mp_context=multiprocessing.get_context("spawn")) as ex:
+        parts = ex.map(extract, [path] * len(starts), starts, ends)
+        return [page for part in parts for page in part]
+
+
+def _pypdf_extract_pages(path: str, start: int, end: int) -> List[str]:
+    from PyPDF2 import PdfReader
+    reader = PdfReader(path)
+    if getattr(reader, "is_encrypted", False):
+        reader.decrypt("")
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def _plumber_extract_pages(path: str, start: int, end: int) -> List[str]:
+    import pdfplumber
+    with pdfplumber.open(path) as pdf:
+        return [(pdf.pages[i].extract_text() or "").strip() for i in range(start, end)]
+
+
+def _pack_boundaries_py(lens, max_chars):
+    """
+    Paragraph packing for chunk_text. Given paragraph lengths, returns an (k, 2)
+    array of [start, end) paragraph ranges, one per chunk. A paragraph longer than
+    max_chars always gets its own range (the caller hard-splits it).
+    """
+    n = len(lens)
+    out = np.empty((n, 2), dtype=np.int64)
+    k = 0
+    start = 0
+    count = 0
+    cur_len = 0
+    for i in range(n):
+        length = lens[i]
+        if length > max_chars:
+            if count > 0:
+                out[k, 0] = start
+                out[k, 1] = i
+                k += 1
+            out[k, 0] = i
+            out[k, 1] = i + 1
+            k += 1
+            start = i + 1
+            count = 0
+            cur_len = 0
+            continue
+        # +2 for the "\n\n" joiner when the window is non-empty
+        add_len = length + (2 if count > 0 else 0)
+        if count > 0 and cur_len + add_len > max_chars:
+            out[k, 0] = start
+            out[k, 1] = i
+            k += 1
+            start = i
+            count = 0
+            cur_len = 0
+        count += 1
+        cur_len += add_len
+    if count > 0:
+        out[k, 0] = start
+        out[k, 1] = n
+        k += 1
+    return out[:k]
+
+
+# Compiled to machine code when numba is installed; plain Python otherwise
+_pack_boundaries = njit(cache=True)(_pack_boundaries_py) if NUMBA_AVAILABLE else _pack_boundaries_py
+
+
+def chunk_text(text: str, max_chars: int = 1600, overlap_chars: int = 250, header: str = "") -> List[str]:
     """
     Chunk text in a more RAG-friendly way than naive whitespace token windows:
     - Normalize whitespace
     - Split into paragraphs (keeps headings/sections together better)
     - Pack paragraphs into ~max_chars windows with character overlap
 
-    This is simple, dependency-free, and behaves much better on PDFs/DOCX.
+    `header` is prepended to the first chunk only, so callers don't have to
+    build a `header + text` copy of the whole document.
+
+    This is simple, dependency-free (numba optionally compiles the packing loop),
+    and behaves much better on PDFs/DOCX.
     """
     if not text:
         return []
 
     t = text.replace("\r", "")
     # normalize whitespace but keep paragraph breaks
-    t = re.sub(r"[ \t]+", " ", t)
-    t = re.sub(r"\n{3,}", "\n\n", t).strip()
+    t = _WS_RE.sub(" ", t)
+    t = _NL_RE.sub("\n\n", t).strip()
     if not t:
         return []
 
     paras = [p.strip() for p in t.split("\n\n") if p.strip()]
     chunks: List[str] = []
-    cur: List[str] = []
-    cur_len = 0
-
-    def flush():
-        nonlocal cur, cur_len
-        if not cur:
-            return
-        chunk = "\n\n".join(cur).strip()
-        if chunk:
-            chunks.append(chunk)
-        cur = []
-        cur_len = 0
+    if NUMBA_AVAILABLE:
+        lens = np.fromiter((len(p) for p in paras), dtype=np.int64, count=len(paras))
+    else:
+        lens = [len(p) for p in paras]
 
-    for p in paras:
+    for s, e in _pack_boundaries(lens, max_chars).tolist():
+        p = paras[s]
         # If a single paragraph is huge, hard-split it.
-        if len(p) > max_chars:
-            flush()
+        if e - s == 1 and len(p) > max_chars:
             start = 0
             while start < len(p):
                 end = min(len(p), start + max_chars)
                 chunks.append(p[start:end].strip())
-                start = max(0, end - overlap_chars)
+                if end == len(p):
+                    break
+                start = max(start + 1, end - overlap_chars)
             continue
 
-        # Pack paragraphs into a window.
-        add_len = len(p) + (2 if cur else 0)
-        if cur_len + add_len > max_chars:
-            flush()
-        cur.append(p)
-        cur_len += add_len
-
-    flush()
+        # Packed window of paragraphs.
+        chunk = "\n\n".join(paras[s:e]).strip()
+        if chunk:
+            chunks.append(chunk)
 
     # Apply overlap between chunks (character overlap) to preserve continuity.
     if overlap_chars > 0 and len(chunks) > 1:
-        overlapped: List[str] = []
-        prev_tail = ""
-        for i, ch in enumerate(chunks):
-            if i == 0:
-                overlapped.append(ch)
-            else:
-                prev_tail = chunks[i - 1][-overlap_chars:]
-                overlapped.append((prev_tail + "\n\n" + ch).strip())
-        chunks = overlapped
+        # Take the tails from the un-overlapped chunks first, then rewrite in place.
+        tails = [c[-overlap_chars:] for c in chunks[:-1]]
+        for i in range(1, len(chunks)):
+            chunks[i] = (tails[i - 1] + "\n\n" + chunks[i]).strip()
+
+    if header and chunks:
+        chunks[0] = header + chunks[0]
 
     return chunks
 
@@ -1,13 +1,55 @@
 import httpx
+import io
+import json
 import logging
-from typing import List, Optional, Tuple
+from typing import AsyncIterator, List, Optional, Tuple
 from .config import settings
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except Exception:
+    ORJSON_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
+_JSON_HEADERS = {"content-type": "application/json"}
+
+# One pooled keep-alive client for all LLM calls (created lazily inside the event loop)
+_HTTP: Optional[httpx.AsyncClient] = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    global _HTTP
+    if _HTTP is None:
+        _HTTP = httpx.AsyncClient(
+            timeout=settings.OLLAMA_TIMEOUT_S,
+            limits=httpx.Limits(max_keepalive_connections=10),
+        )
+    return _HTTP
+
+
+async def aclose_http_client():
+    global _HTTP
+    if _HTTP is not None:
+        await _HTTP.aclose()
+        _HTTP = None
+
+
+def _dumps(payload) -> bytes:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode("utf-8")
+
+
+def _loads(data: bytes):
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
 NOT_IN_DOC_MSG = "The document does not contain this information."
 
-def generate_answer(question: str, contexts: List[str], max_tokens: int = 512) -> str:
+async def generate_answer(question: str, contexts: List[str], max_tokens: int = 512) -> str:
     """
     Generates a concise answer based ONLY on provided contexts.
     """
@@ -18,16 +60,16 @@ def generate_answer(question: str, contexts: List[str], max_tokens: int = 512) -
     
     # Try Ollama first, then fallback to TGI if configured
     if settings.OLLAMA_URL:
-        resp, err = _call_ollama(prompt, max_tokens, settings.OLLAMA_MODEL)
+        resp, err = await _call_ollama(prompt, max_tokens, settings.OLLAMA_MODEL)
         if not err:
             return resp.strip()
     
     if settings.TGI_URL:
-        return _call_tgi(prompt, max_tokens)
+        return await _call_tgi(prompt, max_tokens)
         
     return f"[LLM unavailable] Contexts found:\n\n" + "\n\n".join(contexts)
 
-def generate_assistant_response(instruction: str, contexts: List[str]) -> str:
+async def generate_assistant_response(instruction: str, contexts: List[str]) -> str:
     """
     Generates a structured JSON response for the Codebase Assistant.
     """
@@ -35,17 +77,36 @@ def generate_assistant_response(instruction: str, contexts: List[str]) -> str:
     max_tokens = 4096 # High limit for code generation
     
     if settings.OLLAMA_URL:
-        resp, err = _call_ollama(prompt, max_tokens, settings.OLLAMA_MODEL)
+        resp, err = await _call_ollama(prompt, max_tokens, settings.OLLAMA_MODEL)
         if err:
             logger.error(f"Ollama error: {err}")
             raise RuntimeError(f"Ollama inference failed: {err}")
         return resp.strip()
     
     if settings.TGI_URL:
-        return _call_tgi(prompt, max_tokens)
+        return await _call_tgi(prompt, max_tokens)
         
     raise RuntimeError("No LLM service configured.")
 
+async def stream_assistant_response(instruction: str, contexts: List[str]) -> AsyncIterator[str]:
+    """
+    Streams the Codebase Assistant response token-by-token as the LLM produces it.
+    TGI (non-streaming here) yields its full output as a single piece.
+    """
+    prompt = _build_assistant_system_prompt(instruction, contexts)
+    max_tokens = 4096 # High limit for code generation
+
+    if settings.OLLAMA_URL:
+        async for token in _stream_ollama(prompt, max_tokens, settings.OLLAMA_MODEL):
+            yield token
+        return
+
+    if settings.TGI_URL:
+        yield await _call_tgi(prompt, max_tokens)
+        return
+
+    raise RuntimeError("No LLM service configured.")
+
 def _build_rag_prompt(question: str, contexts: List[str]) -> str:
     system = (
         "You are a helpful assistant that answers questions strictly using provided excerpts.\n"
@@ -54,8 +115,9 @@ def _build_rag_prompt(question: str, contexts: List[str]) -> str:
     ctx_str = "\n\n".join([f"Excerpt {i+1}:\n{c}" for i, c in enumerate(contexts)])
     return f"{system}\n\n{ctx_str}\n\nQuestion: {question}\nAnswer:"
 
-def _build_assistant_system_prompt(instruction: str, contexts: List[str]) -> str:
-    system = """You are a Staff Software Engineer, Technical Architect, and Database Expert.
+# Fixed prefix of every assistant prompt. Kept as one byte-identical constant so the
+# LLM server can reuse its cached KV state for it across requests.
+_ASSISTANT_SYSTEM_PROMPT = """You are a Staff Software Engineer, Technical Architect, and Database Expert.
 Your task is to generate production-ready code and database schemas based on the provided codebase context.
 
 STRICT OPERATIONAL RULES:
@@ -95,33 +157,57 @@ SPECIAL INSTRUCTIONS:
 
 Context excerpts from the codebase:
 """
+
+def _build_assistant_system_prompt(instruction: str, contexts: List[str]) -> str:
     ctx_str = "\n\n".join([f"Context {i+1}:\n{c}" for i, c in enumerate(contexts)])
-    return f"{system}\n{ctx_str}\n\nUser Request: {instruction}\n\nFinal Output (JSON ONLY):"
+    return _ASSISTANT_SYSTEM_PROMPT + "\n" + ctx_str + "\n\nUser Request: " + instruction + "\n\nFinal Output (JSON ONLY):"
 
-def _call_ollama(prompt: str, max_tokens: int, model: str) -> Tuple[str, Optional[str]]:
+async def _call_ollama(prompt: str, max_tokens: int, model: str) -> Tuple[str, Optional[str]]:
     try:
-        payload = {
-            "model": model,
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "num_predict": max_tokens,
-                "temperature": 0.1, # Low temperature for deterministic output
-                "top_p": 0.9
-            }
-        }
-        r = httpx.post(f"{settings.OLLAMA_URL}/api/generate", json=payload, timeout=settings.OLLAMA_TIMEOUT_S)
-        r.raise_for_status()
-        return r.json().get("response", ""), None
+        # Streamed so Ollama doesn't buffer the whole generation; reassembled here
+        buf = io.StringIO()
+        async for token in _stream_ollama(prompt, max_tokens, model):
+            buf.write(token)
+        return buf.getvalue(), None
     except Exception as e:
         return "", str(e)
 
-def _call_tgi(prompt: str, max_tokens: int) -> str:
+async def _stream_ollama(prompt: str, max_tokens: int, model: str) -> AsyncIterator[str]:
+    payload = {
+        "model": model,
+        "prompt": prompt,
+        "stream": True,
+        # keep the model (and its prompt cache) resident between requests
+        "keep_alive": settings.OLLAMA_KEEP_ALIVE,
+        "options": {
+            "num_ctx": settings.OLLAMA_NUM_CTX,
+            "num_predict": max_tokens,
+            "temperature": 0.1, # Low temperature for deterministic output
+            "top_p": 0.9
+        }
+    }
+    url = f"{settings.OLLAMA_URL}/api/generate"
+    async with _get_http_client().stream("POST", url, content=_dumps(payload), headers=_JSON_HEADERS) as r:
+        r.raise_for_status()
+        # Ollama streams one JSON object per line
+        async for line in r.aiter_lines():
+            if not line:
+                continue
+            chunk = _loads(line)
+            if chunk.get("error"):
+                raise RuntimeError(chunk["error"])
+            token = chunk.get("response")
+            if token:
+                yield token
+            if chunk.get("done"):
+                break
+
+async def _call_tgi(prompt: str, max_tokens: int) -> str:
     try:
         payload = {"inputs": prompt, "parameters": {"max_new_tokens": max_tokens}}
-        r = httpx.post(f"{settings.TGI_URL.rstrip('/')}/v1/generate", json=payload, timeout=settings.OLLAMA_TIMEOUT_S)
+        r = await _get_http_client().post(f"{settings.TGI_URL.rstrip('/')}/v1/generate", content=_dumps(payload), headers=_JSON_HEADERS)
         r.raise_for_status()
-        data = r.json()
+        data = _loads(r.content)
         return data.get("generated_text", str(data))
     except Exception as e:
         logger.error(f"TGI error: {e}")
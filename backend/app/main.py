@@ -1,18 +1,26 @@
 import os
 import uuid
 import json
+import asyncio
 import logging
-import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+
+try:
+    # orjson-backed responses serialize large assistant payloads several times faster
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+except Exception:
+    DefaultResponse = JSONResponse
 
 from .config import settings
 from .ingest import extract_text, chunk_text
 from .embeddings import EmbeddingModel
 from .vector_store import InMemoryVectorStore
-from .llm_client import generate_answer
+from .llm_client import generate_answer, aclose_http_client
 from .schemas import QueryRequest, QueryResponse, UploadResponse, QueryHit, AssistantRequest, AssistantResponse
 from .codebase import CodebaseAssistant
 from .services import CodeGenerationService
@@ -26,7 +34,8 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title=settings.APP_NAME,
-    description="Production-ready AI Codebase Assistant with RAG capabilities."
+    description="Production-ready AI Codebase Assistant with RAG capabilities.",
+    default_response_class=DefaultResponse,
 )
 
 app.add_middleware(
@@ -43,18 +52,39 @@ os.makedirs(settings.CHROMA_DIR, exist_ok=True)
 os.makedirs(settings.DATA_DIR, exist_ok=True)
 
 # Document RAG store (Legacy/Upload-based)
-doc_vector_store = InMemoryVectorStore(dim=embedder.dim, persist_directory=settings.CHROMA_DIR)
+doc_vector_store = InMemoryVectorStore(dim=embedder.dim, persist_directory=settings.CHROMA_DIR, dtype=settings.VECTOR_STORE_DTYPE)
 doc_index = {} # metadata store: id -> {filename, path, chunks}
 
 # Codebase RAG store
-assistant_rag = CodebaseAssistant(root_dir=settings.BASE_DIR, embedder=embedder)
+assistant_rag = CodebaseAssistant(root_dir=settings.BASE_DIR, embedder=embedder, dtype=settings.VECTOR_STORE_DTYPE)
 code_gen_service = CodeGenerationService(assistant_rag)
+# Dedicated single worker so startup indexing never competes with the default executor
+indexing_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="indexer")
+
+def _log_indexing_result(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Codebase indexing failed", exc_info=future.exception())
 
 @app.on_event("startup")
 async def startup_event():
     logger.info(f"Starting {settings.APP_NAME}...")
     # Background indexing for the codebase
-    threading.Thread(target=assistant_rag.index_codebase, daemon=True).start()
+    indexing = asyncio.get_running_loop().run_in_executor(indexing_executor, assistant_rag.index_codebase)
+    indexing.add_done_callback(_log_indexing_result)
+    app.state.indexing = indexing
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Stop indexing and wait for it to let go of the stores and the embedder before closing them
+    assistant_rag.stop_indexing()
+    indexing = getattr(app.state, "indexing", None)
+    if indexing is not None:
+        await asyncio.wait([indexing])
+    indexing_executor.shutdown(wait=True, cancel_futures=True)
+    doc_vector_store.close()
+    assistant_rag.vector_store.close()
+    embedder.close()
+    await aclose_http_client()
 
 # --- AI Codebase Assistant Endpoints ---
 
@@ -73,6 +103,24 @@ async def assistant_query(body: AssistantRequest):
         logger.exception("Unexpected error during code generation")
         raise HTTPException(status_code=500, detail="Internal server error during code generation.")
 
+@app.post("/assistant/stream")
+async def assistant_stream(body: AssistantRequest):
+    """
+    Streams the assistant's raw output as Server-Sent Events while it is generated.
+    Each event carries {"token": "..."}; a final `done` (or `error`) event ends the stream.
+    The validated, structured result remains available via /assistant/query.
+    """
+    async def events():
+        try:
+            async for token in code_gen_service.stream_code(body.instruction):
+                yield f"data: {json.dumps({'token': token})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception:
+            logger.exception("Unexpected error during streamed code generation")
+            yield f"event: error\ndata: {json.dumps({'detail': 'Internal server error during code generation.'})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 # --- Document RAG Endpoints (Legacy/Reference) ---
 
 @app.post("/upload", response_model=UploadResponse)
@@ -123,23 +171,25 @@ async def query_documents(body: QueryRequest):
     Generic RAG query against uploaded documents.
     """
     try:
-        q_emb = embedder.embed_texts([body.query])[0]
+        q_emb = embedder.embed_query(body.query)
         results = doc_vector_store.search(q_emb, top_k=body.top_k)
         
         contexts = [r.get("text") for r in results]
-        sources = list(set([r.get("metadata", {}).get("doc_id") for r in results]))
-        answer = generate_answer(body.query, contexts)
+        metadatas = [r.get("metadata") or {} for r in results]
+        # dict.fromkeys dedups while keeping ranking order (set() scrambled it)
+        sources = list(dict.fromkeys(md["doc_id"] for md in metadatas if md.get("doc_id")))
+        answer = await generate_answer(body.query, contexts)
         
         hits = [
             QueryHit(
                 id=r.get("id", ""),
                 score=r.get("score"),
-                doc_id=r.get("metadata", {}).get("doc_id"),
-                filename=r.get("metadata", {}).get("filename"),
-                chunk_index=r.get("metadata", {}).get("chunk_index"),
+                doc_id=md.get("doc_id"),
+                filename=md.get("filename"),
+                chunk_index=md.get("chunk_index"),
                 text=r.get("text") or "",
-                metadata=r.get("metadata") or {}
-            ) for r in results
+                metadata=md
+            ) for r, md in zip(results, metadatas)
         ]
         
         return QueryResponse(answer=answer, sources=sources, hits=hits)
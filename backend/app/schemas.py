@@ -37,6 +37,8 @@ class AssistantFile(BaseModel):
     action: str  # "create" | "modify"
     language: str
     content: str
+    # True if content was cut at the server's size limit
+    truncated: bool = False
 
 
 class AssistantResponse(BaseModel):
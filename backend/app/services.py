@@ -1,21 +1,75 @@
+import asyncio
+import hashlib
+import io
 import json
 import logging
+import ntpath
 import os
-from typing import List, Optional, Dict, Any
-from .llm_client import generate_assistant_response
+import re
+from collections import OrderedDict
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
+from .llm_client import generate_assistant_response, stream_assistant_response
 from .schemas import AssistantResponse, AssistantFile
 from .config import settings
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except Exception:
+    ORJSON_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
+# File extension -> language label for generated files missing one
+_LANG_MAP = {
+    'py': 'python',
+    'ts': 'typescript',
+    'tsx': 'typescript',
+    'js': 'javascript',
+    'jsx': 'javascript',
+    'html': 'html',
+    'css': 'css',
+    'json': 'json',
+    'md': 'markdown',
+    'sql': 'sql',
+    'sh': 'shell',
+    'yml': 'yaml',
+    'yaml': 'yaml',
+    'dockerfile': 'dockerfile'
+}
+
+# Validated responses kept per distinct raw LLM output (see _parse_and_validate)
+PARSE_CACHE_SIZE = 256
+# First '{' through the last '}' in one scan. The closing part is optional so a
+# failed match never restarts at every later '{' (quadratic on brace-heavy text).
+_JSON_BLOCK_RE = re.compile(r'\{(?:.*\})?', re.DOTALL)
+
+
+def _loads(json_str: str):
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.loads(json_str)
+        except orjson.JSONDecodeError:
+            # orjson is stricter (NaN, lone surrogates); the stdlib decides what is invalid
+            pass
+    return json.loads(json_str)
+
+
 class CodeGenerationService:
     """
     Service responsible for orchestrating the code generation process.
     Handles RAG context, LLM interaction, validation, and auto-recovery.
     """
+
+    # Per-file content limit for generated files (1 MiB)
+    _MAX_CONTENT = 1 << 20
     
     def __init__(self, assistant_rag):
         self.assistant_rag = assistant_rag
+        # (schema file signature, concatenated schema context)
+        self._db_ctx_cache: Optional[Tuple[Tuple, str]] = None
+        # blake2b(raw_output) -> validated response, least recently used first
+        self._parse_cache: "OrderedDict[bytes, AssistantResponse]" = OrderedDict()
 
     async def generate_code(self, instruction: str, top_k: int = 15) -> AssistantResponse:
         """
@@ -23,41 +77,73 @@ class CodeGenerationService:
         """
         logger.info(f"Generating code for instruction: {instruction[:100]}...")
         
-        # 1. Retrieve context
-        results = self.assistant_rag.search(instruction, top_k=top_k)
-        contexts = [r.get("text") for r in results]
-        
-        # 2. Add explicit database context if available
-        db_context = self._get_database_context()
-        if db_context:
-            contexts.insert(0, f"DATABASE SCHEMA CONTEXT:\n{db_context}")
+        # 1-2. Retrieve context (codebase + database schema)
+        contexts = await self._build_contexts(instruction, top_k)
         
         # 3. Generate and validate with retries
         max_retries = 2
         last_error = None
         
         for attempt in range(max_retries + 1):
+            # Retries nudge the LLM with a fixed suffix; the prompt prefix stays the same
+            prompt = instruction if attempt == 0 else f"{instruction}\n\nNote: return strictly valid JSON."
             try:
-                raw_output = generate_assistant_response(instruction, contexts)
+                raw_output = await generate_assistant_response(prompt, contexts)
                 return self._parse_and_validate(raw_output)
             except Exception as e:
                 last_error = e
                 logger.warning(f"Generation attempt {attempt + 1} failed: {str(e)}")
-                if attempt < max_retries:
-                    # Modify instruction slightly for retry to nudge the LLM
-                    instruction += " (Ensure valid JSON output format)"
         
         logger.error(f"All generation attempts failed. Last error: {str(last_error)}")
         raise last_error
 
+    async def stream_code(self, instruction: str, top_k: int = 15) -> AsyncIterator[str]:
+        """
+        Streams raw LLM output for an instruction as it is generated.
+        No JSON validation or retries: the client receives tokens directly.
+        """
+        logger.info(f"Streaming code for instruction: {instruction[:100]}...")
+        contexts = await self._build_contexts(instruction, top_k)
+        async for token in stream_assistant_response(instruction, contexts):
+            yield token
+
+    async def _build_contexts(self, instruction: str, top_k: int) -> List[str]:
+        """
+        Retrieves codebase context and prepends explicit database context if available.
+        Both are blocking, so they run concurrently off the event loop.
+        """
+        contexts, db_context = await asyncio.gather(
+            asyncio.to_thread(self.assistant_rag.search_texts, instruction, top_k),
+            asyncio.to_thread(self._get_database_context),
+        )
+        
+        if db_context:
+            contexts.insert(0, f"DATABASE SCHEMA CONTEXT:\n{db_context}")
+        return contexts
+
     def _parse_and_validate(self, raw_output: str) -> AssistantResponse:
         """
         Extracts JSON from LLM output and validates it against the schema.
+        Results are cached by a content hash of the output, so an identical
+        output skips the JSON parse and Pydantic validation.
         """
+        digest = hashlib.blake2b(raw_output.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        cached = self._parse_cache.get(digest)
+        if cached is None:
+            cached = self._parse_and_validate_uncached(raw_output)
+            self._parse_cache[digest] = cached
+            if len(self._parse_cache) > PARSE_CACHE_SIZE:
+                self._parse_cache.popitem(last=False)
+        else:
+            self._parse_cache.move_to_end(digest)
+        # Callers get their own copy; the cached model is never handed out
+        return cached.model_copy(deep=True)
+
+    def _parse_and_validate_uncached(self, raw_output: str) -> AssistantResponse:
         json_str = self._extract_json(raw_output)
         
         try:
-            data = json.loads(json_str)
+            data = _loads(json_str)
         except json.JSONDecodeError as e:
             logger.error(f"JSON decode error: {str(e)}. Raw snippet: {raw_output[:200]}")
             raise ValueError(f"LLM produced invalid JSON: {str(e)}")
@@ -74,28 +160,12 @@ class CodeGenerationService:
         """
         Robustly extracts JSON block from potentially messy LLM output.
         """
-        text = text.strip()
-        start_idx = text.find('{')
-        end_idx = text.rfind('}')
-        
-        if start_idx == -1 or end_idx == -1 or end_idx < start_idx:
-            # Fallback: try to find the first balanced brace block
-            brace_count = 0
-            found_start = False
-            extracted = ""
-            for char in text:
-                if char == '{':
-                    brace_count += 1
-                    found_start = True
-                if found_start:
-                    extracted += char
-                if char == '}':
-                    brace_count -= 1
-                    if brace_count == 0 and found_start:
-                        return extracted
+        match = _JSON_BLOCK_RE.search(text)
+        if match is None or match.end() - match.start() < 2:
+            # No '}' after the first '{': no brace-balanced block can exist either
             raise ValueError("No valid JSON object found in LLM output.")
             
-        return text[start_idx : end_idx + 1]
+        return match.group(0)
 
     def _normalize_schema(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -143,45 +213,45 @@ class CodeGenerationService:
         """
         Guesses programming language based on file extension.
         """
-        ext = path.split('.')[-1].lower() if '.' in path else ''
-        mapping = {
-            'py': 'python',
-            'ts': 'typescript',
-            'tsx': 'typescript',
-            'js': 'javascript',
-            'jsx': 'javascript',
-            'html': 'html',
-            'css': 'css',
-            'json': 'json',
-            'md': 'markdown',
-            'sql': 'sql',
-            'sh': 'shell',
-            'yml': 'yaml',
-            'yaml': 'yaml',
-            'dockerfile': 'dockerfile'
-        }
-        return mapping.get(ext, 'text')
+        ext = os.path.splitext(path)[1][1:].lower()
+        return _LANG_MAP.get(ext, 'text')
 
     def _get_database_context(self) -> str:
         """
         Reads all SQL and schema files from the database directory to provide explicit context.
+        Cached until a schema file is added, removed or modified.
         """
         db_dir = os.path.join(settings.BASE_DIR, "database")
         if not os.path.exists(db_dir):
             return ""
             
-        context_parts = []
+        buf = io.BytesIO()
         try:
-            for file in os.listdir(db_dir):
-                if file.endswith((".sql", ".prisma", ".dbml")):
-                    file_path = os.path.join(db_dir, file)
-                    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                        content = f.read()
-                        context_parts.append(f"--- File: {file} ---\n{content}")
+            # scandir returns the stat info with each entry; the signature costs no reads
+            with os.scandir(db_dir) as it:
+                entries = sorted(
+                    (e for e in it if e.name.endswith((".sql", ".prisma", ".dbml")) and e.is_file()),
+                    key=lambda e: e.name,
+                )
+            signature = tuple((e.name, e.stat().st_mtime_ns, e.stat().st_size) for e in entries)
+            if self._db_ctx_cache is not None and self._db_ctx_cache[0] == signature:
+                return self._db_ctx_cache[1]
+
+            # Raw bytes go into one buffer and are decoded once at the end
+            for i, entry in enumerate(entries):
+                if i:
+                    buf.write(b"\n\n")
+                buf.write(f"--- File: {entry.name} ---\n".encode("utf-8"))
+                # Not mmap: a schema file truncated mid-read would raise SIGBUS and kill the server
+                with open(entry.path, "rb") as f:
+                    buf.write(f.read())
+            db_context = buf.getvalue().decode("utf-8", "ignore")
+            self._db_ctx_cache = (signature, db_context)
+            return db_context
         except Exception as e:
             logger.warning(f"Error reading database context: {str(e)}")
             
-        return "\n\n".join(context_parts)
+        return buf.getvalue().decode("utf-8", "ignore")
 
     def _validate_security(self, data: Dict[str, Any]):
         """
@@ -189,13 +259,32 @@ class CodeGenerationService:
         """
         for file in data.get("files", []):
             path = file.get("path", "")
-            # Prevent absolute paths or path traversal
-            if path.startswith("/") or ".." in path:
+            # Normalize once (either separator) so "a/./../../etc" and "..\\x" are caught too
+            norm = os.path.normpath(path.replace("\\", "/"))
+            if self._is_unsafe_path(norm):
                 logger.warning(f"Security blocked: invalid path '{path}'")
-                file["path"] = os.path.basename(path) # Sanitize to just filename
+                # Sanitize to just filename (without any "C:" drive prefix)
+                name = os.path.basename(ntpath.splitdrive(norm)[1]).replace("\x00", "")
+                file["path"] = "generated_code.txt" if self._is_unsafe_path(name) else name
+            else:
+                file["path"] = norm
             
-            # Limit file content size (e.g., 1MB per file)
+            # Limit file content size (e.g., 1MB per file); the client renders the marker
             content = file.get("content", "")
-            if len(content) > 1024 * 1024:
+            if len(content) > self._MAX_CONTENT:
                 logger.warning(f"Security: file '{path}' content too large")
-                file["content"] = content[:1024 * 1024] + "\n... [TRUNCATED DUE TO SIZE] ..."
+                file["content"] = content[:self._MAX_CONTENT]
+                file["truncated"] = True
+
+    @staticmethod
+    def _is_unsafe_path(norm: str) -> bool:
+        """
+        Absolute, drive-qualified, traversing, NUL-containing or root-resolving
+        (e.g. "foo/..") paths, given a normalized "/"-separated path.
+        """
+        return (
+            norm.startswith(("/", "../"))
+            or norm in ("", ".", "..")
+            or norm[1:2] == ":"
+            or "\x00" in norm
+        )
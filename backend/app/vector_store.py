@@ -1,5 +1,10 @@
 import os
-from typing import List, Dict, Optional
+import threading
+import time
+from collections import defaultdict
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
 
 try:
     import chromadb
@@ -9,11 +14,46 @@ try:
 except Exception:
     CHROMADB_AVAILABLE = False
 
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except Exception:
+    FAISS_AVAILABLE = False
+
+# Chroma persist() rewrites the whole collection; batch writes between calls
+PERSIST_EVERY_ROWS = 2000
+PERSIST_EVERY_S = 5.0
+# Rows of fp16/int8 storage upcast to fp32 per step of a search scan
+SCAN_BLOCK_ROWS = 1024
+# Optional HNSW index (faiss) for the in-memory path once the store is large enough
+ANN_INDEX = os.environ.get("ANN_INDEX", "0").strip().lower() in {"1", "true", "yes", "on"}
+ANN_MIN_ROWS = int(os.environ.get("ANN_MIN_ROWS", "5000"))
+ANN_HNSW_M = 32
+ANN_EF_SEARCH = 64
+# Rows inserted into the HNSW graph per lock hold; bounds how long one insert stalls searches
+ANN_ADD_BLOCK = 64
+
 
 class InMemoryVectorStore:
-    def __init__(self, dim: int, persist_directory: str = None):
+    """
+    Vector store backed by Chroma when available, else an in-memory matrix.
+
+    In-memory vectors are L2-normalized on insert and queries are normalized
+    once per search, so scores are cosine similarities from one matrix-vector
+    product with no per-row division at query time.
+    """
+
+    def __init__(self, dim: int, persist_directory: str = None, dtype=np.float16):
         self.dim = dim
         self.persist_directory = persist_directory
+        # storage dtype for the in-memory path: float32, float16 or int8 (per-vector scale)
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float16, np.int8):
+            raise ValueError(f"Unsupported vector dtype: {self.dtype}")
+        # debounced Chroma persistence (see _mark_dirty / flush)
+        self._dirty = False
+        self._rows_since_persist = 0
+        self._last_persist = time.monotonic()
         # runtime chroma flag (avoid mutating module-global)
         self.use_chroma = CHROMADB_AVAILABLE
         if self.use_chroma:
@@ -32,11 +72,93 @@ class InMemoryVectorStore:
         else:
             self._init_inmemory()
 
+    @property
+    def is_persistent(self) -> bool:
+        """True if vectors survive a restart (Chroma with a persist directory)."""
+        return self.use_chroma and bool(self.persist_directory)
+
+    def _mark_dirty(self, rows: int):
+        """Record a Chroma write; persist only every N rows or T seconds."""
+        if not self.persist_directory:
+            return
+        self._dirty = True
+        self._rows_since_persist += rows
+        if self._rows_since_persist >= PERSIST_EVERY_ROWS or time.monotonic() - self._last_persist > PERSIST_EVERY_S:
+            self.flush()
+
+    def flush(self):
+        """Persist pending Chroma writes now. A no-op for the in-memory backend."""
+        if not (self.use_chroma and self.persist_directory and self._dirty):
+            return
+        self.client.persist()
+        self._dirty = False
+        self._rows_since_persist = 0
+        self._last_persist = time.monotonic()
+
+    def close(self):
+        self.flush()
+
     def _init_inmemory(self):
         self.ids: List[str] = []
-        self.vectors: List[List[float]] = []
         self.texts: List[str] = []
         self.metadatas: List[Dict] = []
+        # metadata doc_id -> row indices, so delete_doc never scans every row
+        self._doc_id_to_rows: Dict[str, List[int]] = defaultdict(list)
+        # Rows [0, _size) of one contiguous (capacity, dim) matrix hold the vectors
+        self._size = 0
+        self._matrix = np.empty((0, self.dim), dtype=self.dtype)
+        # int8 only: dequantization factor per row (max|x| / 127)
+        self._scales = np.empty(0, dtype=np.float32)
+        # Tombstones: deleted rows are flagged here and only dropped on compaction
+        self._alive = np.empty(0, dtype=bool)
+        self._dead_count = 0
+        # per-thread fp32 scratch block for scanning fp16/int8 storage (see _similarities)
+        self._scratch = threading.local()
+        # HNSW graph over rows [0, _size), faiss id == row index; None until ANN_MIN_ROWS
+        self._ann = None
+        # set while a graph is built outside the lock; _generation bumps on every
+        # compaction so a build over pre-compaction row indices is discarded
+        self._ann_building = False
+        self._generation = 0
+        # Guards all in-memory state: searches run on request threads while the
+        # indexer thread adds, deletes and compacts rows. This includes _ann, since
+        # faiss CPU indexes don't support add() concurrent with search().
+        self._lock = threading.RLock()
+        # Serializes writers (add/delete/compact/graph swap) so a writer can release
+        # _lock between small steps without another writer interleaving
+        self._write_lock = threading.RLock()
+
+    def reserve(self, n: int):
+        """
+        Ensure the in-memory matrix can hold at least `n` vectors without
+        reallocating. A no-op for the Chroma backend.
+        """
+        if self.use_chroma:
+            return
+        with self._lock:
+            if n <= self._matrix.shape[0]:
+                return
+            matrix = np.empty((n, self.dim), dtype=self.dtype)
+            matrix[:self._size] = self._matrix[:self._size]
+            self._matrix = matrix
+            alive = np.empty(n, dtype=bool)
+            alive[:self._size] = self._alive[:self._size]
+            self._alive = alive
+            if self.dtype == np.int8:
+                scales = np.empty(n, dtype=np.float32)
+                scales[:self._size] = self._scales[:self._size]
+                self._scales = scales
+
+    def _quantize(self, vectors):
+        batch = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        # normalize in fp32 before any down-cast (out of place: never mutate the caller's array)
+        batch = batch / np.linalg.norm(batch, axis=1, keepdims=True).clip(min=1e-12)
+        if self.dtype != np.int8:
+            return batch, None
+        peak = np.abs(batch).max(axis=1)
+        peak[peak == 0] = 1.0
+        scales = peak / 127.0
+        return np.rint(batch / scales[:, None]), scales
 
     def add_many(self, ids: List[str], vectors: List, texts: List[str], metadatas: Optional[List[Dict]] = None):
         if metadatas is None:
@@ -44,41 +166,204 @@ class InMemoryVectorStore:
         if self.use_chroma:
             self.collection.add(
                 ids=ids,
-                embeddings=[v.tolist() for v in vectors],
+                embeddings=np.asarray(vectors, dtype=np.float32).tolist(),
                 metadatas=metadatas,
                 documents=texts,
             )
-            if self.persist_directory:
-                self.client.persist()
+            self._mark_dirty(len(ids))
         else:
-            for i, vid in enumerate(ids):
-                self.ids.append(vid)
-                self.vectors.append(vectors[i].tolist() if hasattr(vectors[i], 'tolist') else vectors[i])
-                self.texts.append(texts[i])
-                self.metadatas.append(metadatas[i])
+            batch, scales = self._quantize(vectors)
+            with self._write_lock:
+                with self._lock:
+                    start, end = self._size, self._size + len(batch)
+                    if end > self._matrix.shape[0]:
+                        # grow geometrically so a stream of small batches copies O(N) in total
+                        self.reserve(max(end, 2 * self._matrix.shape[0], 64))
+                    # one slice write (with the dtype cast) per batch, no per-row appends
+                    self._matrix[start:end] = batch
+                    if scales is not None:
+                        self._scales[start:end] = scales
+                    self._alive[start:end] = True
+                    self.ids.extend(ids)
+                    self.texts.extend(texts)
+                    self.metadatas.extend(metadatas)
+                    self._index_doc_ids(metadatas, start)
+                if self._ann is not None:
+                    # graph inserts are slow; take the lock per small block so searches
+                    # interleave (the rows stay unpublished until all are in)
+                    vecs = batch if scales is None else batch * scales[:, None]
+                    for lo in range(0, len(vecs), ANN_ADD_BLOCK):
+                        with self._lock:
+                            self._ann.add(vecs[lo:lo + ANN_ADD_BLOCK])
+                # publish the new rows last: a concurrent search only sees rows whose
+                # vector, text, metadata and ANN entry are all in place
+                with self._lock:
+                    self._size = end
+            self._maybe_build_ann()
+
+    def _index_doc_ids(self, metadatas: List[Dict], start: int):
+        for row, md in enumerate(metadatas, start):
+            doc_id = (md or {}).get("doc_id")
+            if doc_id:
+                self._doc_id_to_rows[doc_id].append(row)
 
     def search(self, query_vector, top_k: int = 5) -> List[Dict]:
         if self.use_chroma:
             res = self.collection.query(query_embeddings=[query_vector.tolist()], n_results=top_k, include=['documents','metadatas','distances'])
-            results = []
-            docs = res.get('documents', [[]])[0]
-            metadatas = res.get('metadatas', [[]])[0]
-            distances = res.get('distances', [[]])[0]
-            ids = res.get('ids', [[]])[0]
-            for i in range(len(docs)):
-                results.append({"id": ids[i], "score": float(1 - distances[i]) if distances and distances[i] is not None else None, "text": docs[i], "metadata": metadatas[i]})
-            return results
+            ids, docs, metadatas, distances = (res.get(k, [[]])[0] for k in ('ids', 'documents', 'metadatas', 'distances'))
+            # distances may be missing entirely; keep one (None) score per document
+            distances = distances or [None] * len(docs)
+            return [
+                {"id": i, "score": float(1 - d) if d is not None else None, "text": t, "metadata": m}
+                for i, t, m, d in zip(ids, docs, metadatas, distances)
+            ]
+        # row selection and the list reads must see the same rows (no compaction in between)
+        with self._lock:
+            idx, scores = self._search_rows(query_vector, top_k)
+            return [
+                {"id": self.ids[i], "score": score, "text": self.texts[i], "metadata": self.metadatas[i]}
+                for i, score in zip(idx.tolist(), scores.tolist())
+            ]
+
+    def search_texts(self, query_vector, top_k: int = 5) -> List[str]:
+        """Like search(), but returns only the matching texts, best first."""
+        if self.use_chroma:
+            res = self.collection.query(query_embeddings=[query_vector.tolist()], n_results=top_k, include=['documents'])
+            return list(res.get('documents', [[]])[0])
+        with self._lock:
+            idx, _ = self._search_rows(query_vector, top_k)
+            return [self.texts[i] for i in idx.tolist()]
+
+    def _search_rows(self, query_vector, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """In-memory search: (row indices, scores) of the best live rows, best first."""
+        # read the published row count once; rows past it may still be mid-insert
+        size = self._size
+        if size == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+        q = np.ascontiguousarray(query_vector, dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        if self._ann is not None:
+            return self._search_ann(q, top_k, size)
+        sims = self._similarities(q, size)
+        if self._dead_count:
+            alive = self._alive[:size]
+            sims[~alive] = -np.inf
+            idx = self._top_k(sims, top_k)
+            idx = idx[alive[idx]]
         else:
-            if len(self.vectors) == 0:
-                return []
-            import numpy as np
-            mats = np.array(self.vectors)
-            sims = mats.dot(query_vector)
-            idx = np.argsort(-sims)[:top_k]
-            results = []
-            for i in idx:
-                results.append({"id": self.ids[i], "score": float(sims[i]), "text": self.texts[i], "metadata": self.metadatas[i]})
-            return results
+            idx = self._top_k(sims, top_k)
+        return idx, sims[idx]
+
+    def _similarities(self, q: np.ndarray, size: int) -> np.ndarray:
+        """
+        Scores of every stored row against the fp32 query. fp16/int8 rows are
+        upcast one block at a time into a reused fp32 buffer, so each BLAS
+        sgemv runs on a cache-sized block and no full fp32 copy of the matrix is made.
+        """
+        if self.dtype == np.float32:
+            return self._matrix[:size] @ q
+        scratch = getattr(self._scratch, "block", None)
+        if scratch is None:
+            scratch = self._scratch.block = np.empty((SCAN_BLOCK_ROWS, self.dim), dtype=np.float32)
+        sims = np.empty(size, dtype=np.float32)
+        for start in range(0, size, SCAN_BLOCK_ROWS):
+            end = min(start + SCAN_BLOCK_ROWS, size)
+            block = scratch[:end - start]
+            block[...] = self._matrix[start:end]
+            np.matmul(block, q, out=sims[start:end])
+        if self.dtype == np.int8:
+            sims *= self._scales[:size]
+        return sims
+
+    def _maybe_build_ann(self):
+        """
+        Build the HNSW index once the store reaches ANN_MIN_ROWS (or after a
+        compaction dropped it). Call without holding either lock: the graph is built
+        from a snapshot outside them, so searches (brute force) and writes continue.
+        """
+        if not (ANN_INDEX and FAISS_AVAILABLE):
+            return
+        while True:
+            with self._lock:
+                if self._ann is not None or self._ann_building or self._size < ANN_MIN_ROWS:
+                    return
+                self._ann_building = True
+                generation, size = self._generation, self._size
+                # rows [0, size) are never rewritten in place; reserve/compact swap in new arrays
+                matrix, scales = self._matrix, self._scales
+            try:
+                index = self._new_ann()
+                self._add_rows_to_ann(index, matrix, scales, 0, size)
+            except BaseException:
+                with self._lock:
+                    self._ann_building = False
+                raise
+            # No writer runs while we catch up and swap, so every published row ends
+            # up in the graph; the graph is still private, so searches aren't blocked
+            with self._write_lock:
+                try:
+                    if generation != self._generation:
+                        # compacted meanwhile: row indices shifted, build again
+                        continue
+                    # catch up on rows added while the graph was being built
+                    self._add_rows_to_ann(index, self._matrix, self._scales, size, self._size)
+                    with self._lock:
+                        self._ann = index
+                    return
+                finally:
+                    with self._lock:
+                        self._ann_building = False
+
+    def _new_ann(self):
+        """
+        fp32 stores keep exact vectors in the graph; fp16/int8 stores use fp16
+        scalar-quantized vectors so the index doesn't hold a full fp32 copy.
+        """
+        if self.dtype == np.float32:
+            return faiss.IndexHNSWFlat(self.dim, ANN_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        return faiss.IndexHNSWSQ(self.dim, faiss.ScalarQuantizer.QT_fp16, ANN_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+
+    def _add_rows_to_ann(self, index, matrix: np.ndarray, scales: np.ndarray, start: int, stop: int):
+        """Add rows [start, stop), dead ones included, so faiss ids stay row indices."""
+        for lo in range(start, stop, SCAN_BLOCK_ROWS):
+            hi = min(lo + SCAN_BLOCK_ROWS, stop)
+            block = matrix[lo:hi].astype(np.float32)
+            if self.dtype == np.int8:
+                block *= scales[lo:hi, None]
+            index.add(block)
+
+    def _search_ann(self, q: np.ndarray, top_k: int, size: int) -> Tuple[np.ndarray, np.ndarray]:
+        # caller holds self._lock
+        k = min(size, top_k)
+        if k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+        # Per-call parameters: the shared index is never mutated by a search
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = max(ANN_EF_SEARCH, k)
+        if self._dead_count:
+            # Tombstoned rows are skipped inside the graph walk, so they neither crowd
+            # out live hits nor force a wider search (bit i of byte i >> 3 = row i alive)
+            bits = np.packbits(self._alive[:size], bitorder="little")
+            params.sel = faiss.IDSelectorBitmap(size, faiss.swig_ptr(bits))
+        scores, idx = self._ann.search(q[None, :], k, params=params)
+        scores, idx = scores[0], idx[0]
+        # faiss pads with -1 when fewer than k neighbours are reachable
+        keep = (idx >= 0) & (idx < size)
+        keep[keep] = self._alive[idx[keep]]
+        return idx[keep][:top_k], scores[keep][:top_k]
+
+    @staticmethod
+    def _top_k(sims: np.ndarray, top_k: int) -> np.ndarray:
+        """Indices of the top_k highest scores, best first (O(N) select + O(k log k) sort)."""
+        n = sims.shape[0]
+        k = min(top_k, n)
+        if k <= 0:
+            return np.empty(0, dtype=np.intp)
+        if k * 4 >= n:
+            # k is a sizeable fraction of N: one full sort beats select + sort
+            return np.argsort(-sims)[:k]
+        part = np.argpartition(-sims, k - 1)[:k]
+        return part[np.argsort(-sims[part])]
 
     def delete_doc(self, doc_id: str) -> int:
         """
@@ -93,8 +378,7 @@ class InMemoryVectorStore:
             try:
                 # NOTE: depending on Chroma version, where filter may vary.
                 self.collection.delete(where={"doc_id": doc_id})
-                if self.persist_directory:
-                    self.client.persist()
+                self._mark_dirty(1)
                 return 0
             except Exception:
                 # fall back to best-effort id-based delete if available
@@ -104,30 +388,77 @@ class InMemoryVectorStore:
                     ids = res.get("ids") or []
                     if ids:
                         self.collection.delete(ids=ids)
-                        if self.persist_directory:
-                            self.client.persist()
+                        self._mark_dirty(len(ids))
                         return len(ids)
                 except Exception:
                     pass
                 return 0
 
         # In-memory delete
-        keep_ids = []
-        keep_vectors = []
-        keep_texts = []
-        keep_metas = []
-        deleted = 0
-        for i in range(len(self.ids)):
-            md = self.metadatas[i] or {}
-            if md.get("doc_id") == doc_id:
-                deleted += 1
-                continue
-            keep_ids.append(self.ids[i])
-            keep_vectors.append(self.vectors[i])
-            keep_texts.append(self.texts[i])
-            keep_metas.append(self.metadatas[i])
-        self.ids = keep_ids
-        self.vectors = keep_vectors
-        self.texts = keep_texts
-        self.metadatas = keep_metas
+        with self._write_lock, self._lock:
+            rows = self._doc_id_to_rows.pop(doc_id, None)
+            if not rows:
+                return 0
+            deleted = self._mark_dead(np.asarray(rows, dtype=np.intp))
+        self._maybe_build_ann()
         return deleted
+
+    def delete_ids(self, ids: List[str]) -> int:
+        """
+        Delete vectors/chunks by id. Returns number of deleted chunks (best-effort for Chroma).
+        """
+        if not ids:
+            return 0
+
+        if self.use_chroma:
+            try:
+                self.collection.delete(ids=list(ids))
+                self._mark_dirty(len(ids))
+                return len(ids)
+            except Exception:
+                return 0
+
+        drop = set(ids)
+        with self._write_lock, self._lock:
+            hit = np.fromiter((vid in drop for vid in self.ids), dtype=bool, count=self._size)
+            deleted = self._mark_dead(hit)
+        self._maybe_build_ann()
+        return deleted
+
+    def _mark_dead(self, rows) -> int:
+        """
+        Tombstone the given rows (bool mask or indices) and return how many were
+        live. Storage is compacted once more than 25% of rows are dead.
+        """
+        with self._lock:
+            alive = self._alive[:self._size]
+            rows = np.flatnonzero(rows) if getattr(rows, "dtype", None) == bool else np.asarray(rows, dtype=np.intp)
+            rows = rows[alive[rows]]
+            if rows.size == 0:
+                return 0
+            alive[rows] = False
+            self._dead_count += int(rows.size)
+            if self._dead_count > 0.25 * self._size:
+                self._compact()
+            return int(rows.size)
+
+    def _compact(self):
+        """Drop tombstoned rows from the matrix and the parallel lists."""
+        with self._lock:
+            keep = self._alive[:self._size].copy()
+            self._matrix = self._matrix[:self._size][keep]
+            if self.dtype == np.int8:
+                self._scales = self._scales[:self._size][keep]
+            self._size = self._matrix.shape[0]
+            self._alive = np.ones(self._size, dtype=bool)
+            self._dead_count = 0
+            self.ids = [v for v, k in zip(self.ids, keep) if k]
+            self.texts = [v for v, k in zip(self.texts, keep) if k]
+            self.metadatas = [v for v, k in zip(self.metadatas, keep) if k]
+            # row indices shifted (and tombstoned rows are gone), so re-derive the doc_id index
+            self._doc_id_to_rows = defaultdict(list)
+            self._index_doc_ids(self.metadatas, 0)
+            # row indices shifted and HNSW has no removal: drop the graph; the caller
+            # rebuilds it outside the lock (see _maybe_build_ann)
+            self._ann = None
+            self._generation += 1
@@ -98,6 +98,7 @@ export const ResultViewer: React.FC<ResultViewerProps> = ({ result }) => {
           <div className="flex-1 overflow-auto p-4">
             <pre className="text-sm font-mono text-gray-300 whitespace-pre">
               <code>{selectedFile?.content}</code>
+              {selectedFile?.truncated && '\n... [TRUNCATED DUE TO SIZE] ...'}
             </pre>
           </div>
         </div>
@@ -32,6 +32,7 @@ export type AssistantFile = {
   action: 'create' | 'modify'
   language: string
   content: string
+  truncated?: boolean
 }
 
 export type AssistantResponse = {
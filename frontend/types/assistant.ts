@@ -3,6 +3,7 @@ export interface AssistantFile {
   action: 'create' | 'modify';
   language: string;
   content: string;
+  truncated?: boolean;
 }
 
 export interface AssistantResponse {